@@ -1,72 +1,534 @@
 import os
-import subprocess
+import re
+import ast
+import sys
+import io
+import json
+import signal
+import hashlib
+import difflib
+import threading
+import traceback
+import contextlib
 import tempfile
 import asyncio
-import py_compile
-from openai import OpenAI
+import argparse
+import aiofiles
+import httpx
+import time
+import uuid
+import openai
+from openai import AsyncOpenAI
+from tenacity import retry, stop_after_attempt, wait_random_exponential, retry_if_exception_type, retry_if_exception
 from dotenv import load_dotenv
+from semantic_cache import SemanticCache
 
 # ---------------------------
 # Configuration and Parameterisation
 # ---------------------------
 CONFIG = {
     "model": "gpt-4o",
+    "feedback_model": "gpt-4o-mini",  # smaller, faster model for the bojack_horseman/mr_peanut_butter critics
+    "summary_model": "gpt-4o-mini",  # cheap model for the rolling summary passed to the Judge
     "temperature": 0.7,
+    "deterministic_temperature": 0,  # used by the Manager and Judge so their responses are cacheable
+    # Output caps per node: a lower max_tokens lowers latency even when the actual output is similar
+    "max_tokens": {
+        "manager": 800,
+        "coder": 2000,
+        "critic": 800,  # shared by both critiques (400 each) in the single dual-critic call
+        "summary": 300,
+        "judge": 600,
+        "reporter": 1500
+    },
     "max_review_iterations": 3,
-    "api_timeout": 10  # seconds for subprocess.run timeout
+    "api_timeout": 10,  # seconds before an executing generated script is stopped
+    "execution_mode": "in_process",  # "in_process" (fast, no isolation) or "subprocess" (isolated interpreter)
+    "http_timeout": 60,  # seconds for OpenAI HTTP requests
+    "http_max_keepalive_connections": 20,
+    "http_keepalive_expiry": 60,  # seconds an idle connection is kept open for reuse
+    "retry_attempts": 5,  # attempts per LLM call on rate limits, connection errors and timeouts
+    "retry_max_wait": 30,  # upper bound in seconds for the randomised exponential backoff
+    "save_solution": True,  # write the generated script to ./output/solution.py for inspection
+    "checkpoint_path": "./output/.ckpt.json",  # pipeline state after each stage, used by --resume
+    "conversation_log_path": "./output/conversation.jsonl",  # append-only log, one JSON record per exchange
+    "reporter_chunk_size": 20,  # log records per map-step summary when the log is too long for one prompt
+    "cache_dir": "./output/.llm_cache",  # persistent LLM response cache keyed by prompt hash
+    "outline_cache_dir": "./output/.outlines",  # manager outlines keyed by the SHA-256 of the user request
+    "outline_cache_ttl": None,  # seconds before a cached outline expires; None keeps outlines indefinitely
+    "semantic_cache_dir": "./output/.semantic_cache",
+    "semantic_cache_threshold": 0.92,  # cosine similarity above which a near-duplicate prompt is a hit
+    "stream": True,  # stream completions so tokens are shown as soon as they are generated
+    "reporter_batch": False,  # queue reports for the OpenAI Batch API (50% cost) instead of calling in real time
+    "batch_dir": "./output/.batch"
 }
 
 # Load environment variables from the .env file.
 load_dotenv()
 
 # Initialise the OpenAI client using the API key.
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# A single HTTP/2 connection pool is shared by every call, so TLS sessions are reused across the pipeline
+# and concurrent requests are multiplexed over one connection.
+http_client = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(
+        max_keepalive_connections=CONFIG["http_max_keepalive_connections"],
+        keepalive_expiry=CONFIG["http_keepalive_expiry"]
+    ),
+    timeout=CONFIG["http_timeout"]
+)
+# Retries are handled by request_chat_completion, so the client's built-in retries are disabled.
+client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=http_client, max_retries=0)
 if not client.api_key:
     raise ValueError("OPENAI_API_KEY not found in environment variables.")
 
+
 # ---------------------------
-# Global Conversation Log for Stateful Context
+# Persistent LLM Response Cache
 # ---------------------------
-conversation_log = []
+def restart_stream(retry_state):
+    """Before a retry, lets the console stream mark any partial output from the failed attempt as discarded."""
+    on_token = retry_state.kwargs.get("on_token")
+    if hasattr(on_token, "restart"):
+        on_token.restart()
+
+
+# The SDK's own retries are disabled (max_retries=0), so 5xx, 408 and 409 responses are retried here too.
+# A connection dropped part-way through a stream surfaces as a raw httpx.TransportError, not APIConnectionError.
+@retry(
+    stop=stop_after_attempt(CONFIG["retry_attempts"]),
+    wait=wait_random_exponential(multiplier=1, max=CONFIG["retry_max_wait"]),
+    retry=retry_if_exception_type((
+        openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError, openai.InternalServerError,
+        openai.ConflictError, httpx.TransportError
+    )) | retry_if_exception(lambda e: isinstance(e, openai.APIStatusError) and e.status_code == 408),
+    before_sleep=restart_stream,
+    reraise=True
+)
+async def request_chat_completion(messages, on_token=None, **kwargs):
+    """
+    Sends a chat completion request and returns its content and finish reason, retrying transient
+    failures with exponential backoff and jitter.
+    """
+    if CONFIG["stream"]:
+        parts = []
+        finish_reason = None
+        stream = await client.chat.completions.create(messages=messages, stream=True, **kwargs)
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            token = chunk.choices[0].delta.content or ""
+            parts.append(token)
+            finish_reason = chunk.choices[0].finish_reason or finish_reason
+            if on_token and token:
+                on_token(token)
+        return "".join(parts), finish_reason
+
+    response = await client.chat.completions.create(messages=messages, **kwargs)
+    return response.choices[0].message.content, response.choices[0].finish_reason
+
+
+async def cached_chat_completion(messages, on_token=None, validate=None, **kwargs):
+    """
+    Returns the content of a chat completion for the given messages, using a disk cache keyed by
+    the SHA-256 of the request (messages, model, temperature and any extra parameters).
+    Identical prompts are only sent to the API once.
+    Responses cut off by max_tokens, or rejected by the optional validate(content) callable, are
+    returned but never cached, so a bad response is not replayed on every later run.
+    When streaming is enabled, on_token is called with each piece of text as it arrives.
+    """
+    kwargs.setdefault("model", CONFIG["model"])
+    kwargs.setdefault("temperature", CONFIG["temperature"])
+    key_source = json.dumps({"messages": messages, **kwargs}, sort_keys=True)
+    key = hashlib.sha256(key_source.encode("utf-8")).hexdigest()
+    cache_path = os.path.join(CONFIG["cache_dir"], f"{key}.json")
+
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path, "r", encoding="utf-8") as f:
+                content = json.load(f)["content"]
+            if validate is None or validate(content):
+                return content
+        except (OSError, ValueError, KeyError, TypeError):
+            pass  # an unreadable or truncated entry is treated as a cache miss and overwritten below
+
+    content, finish_reason = await request_chat_completion(messages, on_token=on_token, **kwargs)
+
+    if finish_reason != "length" and (validate is None or validate(content)):
+        # Written atomically, so an interrupted write never leaves a truncated entry behind
+        atomic_write_text(cache_path, json.dumps({"model": kwargs["model"], "content": content}))
+    return content
+
+
+class ConsoleStream:
+    def __init__(self, heading):
+        """
+        :param heading: The heading printed before the first streamed token.
+        """
+        self.heading = heading
+        self.started = False
+
+    def __call__(self, token):
+        """Print a streamed token in real time."""
+        if not self.started:
+            print(f"\n{self.heading}:")
+            self.started = True
+        print(token, end="", flush=True)
+
+    def restart(self):
+        """Mark streamed output from a failed attempt as discarded, so the retried response is printed afresh."""
+        if self.started:
+            print("\n[request failed, retrying; the partial output above is discarded]")
+            self.started = False
+
+    def finish(self, text):
+        """Print the full text if nothing was streamed (cache hit or error), then end the line."""
+        if not self.started:
+            self(text)
+        print()
+
+
+def outline_cache_path(user_request):
+    """Returns the path of the cached Manager outline for the given user request."""
+    key = hashlib.sha256(user_request.encode("utf-8")).hexdigest()
+    return os.path.join(CONFIG["outline_cache_dir"], f"{key}.txt")
+
+
+def load_cached_outline(user_request):
+    """
+    Returns the cached Manager outline for the user request, or None if there is no outline
+    or it is older than CONFIG["outline_cache_ttl"] seconds.
+    """
+    path = outline_cache_path(user_request)
+    if not os.path.exists(path):
+        return None
+    ttl = CONFIG["outline_cache_ttl"]
+    if ttl is not None and time.time() - os.path.getmtime(path) > ttl:
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def atomic_write_text(path, text):
+    """Writes text to a temporary file next to path and renames it into place, so readers never see a partial file."""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=directory, suffix=".tmp", delete=False) as f:
+        f.write(text)
+    os.replace(f.name, path)
+
+
+def save_cached_outline(user_request, outline):
+    """Atomically writes the Manager outline for the user request."""
+    atomic_write_text(outline_cache_path(user_request), outline)
+
+
+# Semantic cache for the Manager, keyed on the short user request only, so reworded but equivalent
+# requests reuse earlier outlines. The Judge only uses the exact-hash response cache: its prompts are
+# too long for the embedding model and differ by small code fixes that embeddings cannot tell apart.
+manager_semantic_cache = SemanticCache(
+    os.path.join(CONFIG["semantic_cache_dir"], "manager"), threshold=CONFIG["semantic_cache_threshold"])
+
+
+# ---------------------------
+# Append-Only Conversation Log for Stateful Context
+# ---------------------------
+# Identifies the records of this pipeline run in the shared log file.
+run_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+# Records of this run logged so far (saved in the checkpoint), and records already on disk that a
+# resumed run replays after its last checkpoint and must not write a second time.
+logged_records = 0
+records_to_skip = 0
+
+
+def log_event(role, content):
+    """
+    Appends one record (timestamp, run id, role, content) to the conversation log on disk,
+    so the log survives a crash and is never held in memory in full.
+    """
+    global logged_records, records_to_skip
+    logged_records += 1
+    if records_to_skip:
+        records_to_skip -= 1
+        return
+    path = CONFIG["conversation_log_path"]
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    record = {"ts": time.strftime("%Y-%m-%dT%H:%M:%S"), "run_id": run_id, "role": role, "content": content}
+    with open(path, "ab") as f:
+        # A line torn by a crash mid-append is terminated first, so the new record starts on a line of its own
+        if f.tell() and not log_ends_with_newline(path):
+            f.write(b"\n")
+        f.write((json.dumps(record) + "\n").encode("utf-8"))
+
+
+def log_ends_with_newline(path):
+    """Returns True if the conversation log's last byte is a newline."""
+    with open(path, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+
+def read_conversation_log(run=None):
+    """
+    Yields the records of the given run (by default the current run) from the conversation log.
+    Lines that cannot be decoded (e.g. torn by a crash mid-append) are skipped.
+    """
+    run = run or run_id
+    path = CONFIG["conversation_log_path"]
+    if not os.path.exists(path):
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(record, dict) and record.get("run_id") == run:
+                yield record
+
+
+# ---------------------------
+# Checkpoint Recovery
+# ---------------------------
+def save_checkpoint(state):
+    """Atomically writes the pipeline state, so an interrupted run can be resumed with --resume."""
+    atomic_write_text(CONFIG["checkpoint_path"], json.dumps(state))
+
+
+def load_checkpoint():
+    """Returns the saved pipeline state, or None if there is no checkpoint."""
+    if not os.path.exists(CONFIG["checkpoint_path"]):
+        return None
+    with open(CONFIG["checkpoint_path"], "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def clear_checkpoint():
+    """Removes the checkpoint once a run has completed."""
+    if os.path.exists(CONFIG["checkpoint_path"]):
+        os.remove(CONFIG["checkpoint_path"])
 
 
 # ---------------------------
-# LangGraph Node Infrastructure with Real-Time Logging
+# LangGraph Node Infrastructure: Async DAG Runner
 # ---------------------------
 class Node:
-    def __init__(self, name, function=None):
+    def __init__(self, name, function, depends_on=()):
         """
         :param name: A descriptive name for the node.
-        :param function: A callable that processes input data.
+        :param function: An async callable that receives the outputs of its dependencies as keyword arguments.
+        :param depends_on: Names of the nodes whose outputs this node needs.
         """
         self.name = name
         self.function = function
-        self.next_node = None
+        self.depends_on = tuple(depends_on)
+
+    async def process(self, inputs):
+        """Process the outputs of this node's dependencies."""
+        return await self.function(**inputs)
+
+
+async def run_dag(nodes):
+    """
+    Runs the nodes as a DAG: each node starts as soon as all of its dependencies have finished,
+    so independent nodes run concurrently. Nodes must be listed after the nodes they depend on.
+    Returns a dictionary mapping each node name to its output.
+    """
+    tasks = {}
 
-    def set_next(self, node):
-        """Connect this node to the next node in the pipeline."""
-        self.next_node = node
+    async def run_node(node, dependencies):
+        outputs = await asyncio.gather(*dependencies.values())
+        return await node.process(dict(zip(dependencies, outputs)))
 
-    def process(self, data):
-        """Process data through this node, printing the input and output in real time."""
-        print(f"[{self.name}] Received input: {data}")
-        result = self.function(data) if self.function else data
-        print(f"[{self.name}] Produced output: {result}")
-        if self.next_node:
-            return self.next_node.process(result)
-        return result
+    for node in nodes:
+        missing = [name for name in node.depends_on if name not in tasks]
+        if missing:
+            raise ValueError(f"Node '{node.name}' depends on unknown or later nodes: {', '.join(missing)}")
+        dependencies = {name: tasks[name] for name in node.depends_on}
+        tasks[node.name] = asyncio.ensure_future(run_node(node, dependencies))
+
+    try:
+        outputs = await asyncio.gather(*tasks.values())
+    except BaseException:
+        for task in tasks.values():
+            task.cancel()
+        raise
+    return dict(zip(tasks, outputs))
+
+
+# ---------------------------
+# In-Process Execution of Generated Scripts
+# ---------------------------
+def strip_markdown_fences(text):
+    """
+    Returns the Python code from a coder response. Models sometimes wrap the code in a markdown fence
+    despite being told not to; the first fenced block is used if there is one, otherwise the text is
+    returned with any stray leading or trailing fence line removed.
+    """
+    match = re.search(r"^```[\w+-]*[ \t]*\n(.*?)(?:^```[ \t]*$|\Z)", text, flags=re.MULTILINE | re.DOTALL)
+    if match:
+        return match.group(1).strip()
+    text = re.sub(r"\A\s*```[\w+-]*[ \t]*$", "", text, flags=re.MULTILINE)
+    text = re.sub(r"^```[ \t]*\s*\Z", "", text, flags=re.MULTILINE)
+    return text.strip()
+
+
+def make_headless(code_text):
+    """
+    Inserts `import matplotlib; matplotlib.use('Agg')` before the first top-level matplotlib import,
+    so the script (including the saved copy) never opens a GUI window or blocks in plt.show().
+    Code that does not use matplotlib, or already selects a backend, is returned unchanged.
+    """
+    if "matplotlib.use(" in code_text:
+        return code_text
+    match = re.search(r"^(?:import|from)\s+matplotlib\b", code_text, flags=re.MULTILINE)
+    if not match:
+        return code_text
+    headless_line = "import matplotlib; matplotlib.use('Agg')  # headless backend added by the pipeline\n"
+    return code_text[:match.start()] + headless_line + code_text[match.start():]
+
+
+class ScriptTimeout(BaseException):
+    """
+    Raised inside a generated script when it exceeds CONFIG["api_timeout"]. Derives from BaseException
+    so that the script's own `except Exception:` blocks cannot swallow it.
+    """
+
+
+# Scripts importing these need an interpreter of their own: asyncio.run() cannot be called from the
+# pipeline's running event loop, and multiprocessing re-imports __main__, which is the pipeline itself.
+SUBPROCESS_ONLY_MODULES = {"asyncio", "multiprocessing", "concurrent"}
+
+
+def needs_subprocess(tree):
+    """Returns True if the parsed script imports a module that cannot run in-process (see SUBPROCESS_ONLY_MODULES)."""
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            names = [node.module]
+        else:
+            continue
+        if any(name.split(".")[0] in SUBPROCESS_ONLY_MODULES for name in names):
+            return True
+    return False
+
+
+def run_script_in_process(code_obj, script_path):
+    """
+    Executes compiled script code in this interpreter instead of spawning a new one, returning its
+    captured stdout and stderr. A wall-clock timer stops scripts running longer than CONFIG["api_timeout"]
+    seconds, and matplotlib is switched to the non-interactive Agg backend so plt.show() cannot block.
+
+    There is no isolation from the pipeline: a script calling os._exit() ends the pipeline, and changes
+    to the working directory (os.chdir), sys.modules or other global interpreter state persist after it
+    returns, and a script that catches BaseException in an endless loop cannot be stopped. The script runs
+    inside the pipeline's event loop, so asyncio.run() fails and multiprocessing misbehaves; coder_function
+    sends scripts importing those modules to run_script_in_subprocess instead (see needs_subprocess).
+    Set CONFIG["execution_mode"] to "subprocess" to run every script in a separate interpreter.
+    """
+    if any(name.startswith("matplotlib") for name in code_obj.co_names):
+        import matplotlib
+        matplotlib.use("Agg")
+
+    own_frame = sys._getframe()
+
+    def on_timeout(signum, frame):
+        # A signal landing in this function's own code (i.e. after exec has returned, while the timer is
+        # being cancelled) is ignored, so the cleanup below can never be interrupted.
+        if frame is not own_frame:
+            raise ScriptTimeout(f"Script exceeded the time limit of {CONFIG['api_timeout']} seconds")
+
+    # SIGALRM is only available on POSIX and can only be handled in the main thread.
+    # The timer keeps re-firing every second after the deadline, so a script that catches
+    # ScriptTimeout (e.g. with a bare except) is interrupted again until exec returns.
+    use_alarm = hasattr(signal, "SIGALRM") and threading.current_thread() is threading.main_thread()
+    if use_alarm:
+        previous_handler = signal.signal(signal.SIGALRM, on_timeout)
+        signal.setitimer(signal.ITIMER_REAL, CONFIG["api_timeout"], 1)
+
+    stdout_buffer = io.StringIO()
+    stderr_buffer = io.StringIO()
+    # The script sees its own path as argv, not the pipeline's command-line options
+    pipeline_argv = sys.argv
+    sys.argv = [script_path]
+    try:
+        try:
+            with contextlib.redirect_stdout(stdout_buffer), contextlib.redirect_stderr(stderr_buffer):
+                exec(code_obj, {"__name__": "__main__", "__file__": script_path})
+        finally:
+            if use_alarm:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+                signal.signal(signal.SIGALRM, previous_handler)
+            sys.argv = pipeline_argv
+    except ScriptTimeout as e:
+        stderr_buffer.write(f"Error running code: {e}\n")
+    except SystemExit as e:
+        if e.code not in (None, 0):
+            stderr_buffer.write(f"Script exited with status {e.code}\n")
+    except Exception as e:
+        # Skip the first frame (the exec call above), so the traceback starts in the script
+        stderr_buffer.write("".join(traceback.format_exception(type(e), e, e.__traceback__.tb_next)))
+    finally:
+        # Release figures created by the script so they do not accumulate across iterations
+        if "matplotlib.pyplot" in sys.modules:
+            sys.modules["matplotlib.pyplot"].close("all")
+
+    return stdout_buffer.getvalue() + "\n" + stderr_buffer.getvalue()
+
+
+async def run_script_in_subprocess(code_text, script_path):
+    """
+    Executes the script in a separate python interpreter, returning its stdout and stderr.
+    Slower than run_script_in_process, but fully isolated from the pipeline; the process is
+    killed if it runs longer than CONFIG["api_timeout"] seconds.
+    """
+    temporary_path = None
+    if not os.path.exists(script_path):
+        # The script is not saved to disk (CONFIG["save_solution"] is off), so run a temporary copy
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8", suffix=".py", delete=False) as f:
+            f.write(code_text)
+        script_path = temporary_path = f.name
+    try:
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, script_path,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            env={**os.environ, "MPLBACKEND": "Agg"}
+        )
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=CONFIG["api_timeout"])
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.communicate()
+            return f"Error running code: Script exceeded the time limit of {CONFIG['api_timeout']} seconds"
+        return stdout.decode(errors="replace") + "\n" + stderr.decode(errors="replace")
+    finally:
+        if temporary_path:
+            os.remove(temporary_path)
 
 
 # ---------------------------
 # LLM Functions for Manager, Coder, Feedback, Judge, and Reporter Nodes
 # ---------------------------
-def manager_function(request):
+async def manager_function(request, on_token=None):
     """
     Calls the Manager LLM to outline the plan.
     """
     try:
-        response = client.chat.completions.create(
-            model=CONFIG["model"],
+        # The semantic cache is an optimisation only: if it fails (e.g. the embedding model cannot be
+        # downloaded), the Manager falls through to the API rather than failing with it
+        try:
+            cached_outline = manager_semantic_cache.lookup(request)
+        except Exception as e:
+            print(f"Semantic cache lookup failed, calling the Manager: {e}")
+            cached_outline = None
+        if cached_outline is not None:
+            return cached_outline
+
+        content = await cached_chat_completion(
             messages=[
                 {"role": "system",
                  "content": (
@@ -76,204 +538,290 @@ def manager_function(request):
                  )},
                 {"role": "user", "content": request}
             ],
-            temperature=CONFIG["temperature"]
+            temperature=CONFIG["deterministic_temperature"],
+            max_tokens=CONFIG["max_tokens"]["manager"],
+            on_token=on_token
         )
-        outline = response.choices[0].message.content.strip()
+        outline = content.strip()
+        try:
+            manager_semantic_cache.add(request, outline)
+        except Exception as e:
+            print(f"Could not store the outline in the semantic cache: {e}")
         return outline
     except Exception as e:
         return f"An error occurred in manager_function: {e}"
 
 
-def coder_function(plan, extra_instruction=""):
+async def coder_function(plan, extra_instruction="", on_token=None):
     """
     Calls the Coder LLM to generate Python code based on the plan and optional extra instructions.
     Saves the code and executes it.
     Returns a dictionary with the code and its execution output.
     """
     try:
-        prompt = (
-            f"Here is the plan:\n\n{plan}\n\n"
-            "Please produce only the Python code implementation for the above plan. "
-            "Ensure that the code is plain Python (do not include markdown formatting such as triple backticks) "
-            "and that it compiles without syntax errors."
-        )
+        # The plan and instructions are identical across iterations, so they lead the prompt where
+        # OpenAI's automatic prompt caching can reuse them; only the Judge's instruction changes.
+        messages = [
+            {"role": "system",
+             "content": (
+                 "You are a coder. Based on the provided plan, generate only the Python code implementation. "
+                 "Do not include any markdown formatting. Output plain Python code only. "
+                 "Ensure the code compiles without syntax errors."
+             )},
+            {"role": "user",
+             "content": (
+                 f"Here is the plan:\n\n{plan}\n\n"
+                 "Please produce only the Python code implementation for the above plan. "
+                 "Ensure that the code is plain Python (do not include markdown formatting such as triple backticks) "
+                 "and that it compiles without syntax errors. "
+                 "The code runs headless: if it plots with matplotlib, call matplotlib.use('Agg') before importing "
+                 "matplotlib.pyplot and save figures into the output directory with plt.savefig "
+                 "(e.g. plt.savefig('output/hist.png')) instead of plt.show()."
+             )}
+        ]
         if extra_instruction:
-            prompt += f"\n\nAdditionally, incorporate the following instruction into your code: {extra_instruction}"
+            messages.append({
+                "role": "user",
+                "content": f"Additionally, incorporate the following instruction into your code: {extra_instruction}"
+            })
 
-        response = client.chat.completions.create(
-            model=CONFIG["model"],
-            messages=[
-                {"role": "system",
-                 "content": (
-                     "You are a coder. Based on the provided plan, generate only the Python code implementation. "
-                     "Do not include any markdown formatting. Output plain Python code only. "
-                     "Ensure the code compiles without syntax errors."
-                 )},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=CONFIG["temperature"]
+        content = await cached_chat_completion(
+            messages=messages,
+            temperature=CONFIG["temperature"],
+            max_tokens=CONFIG["max_tokens"]["coder"],
+            on_token=on_token
         )
-        code_text = response.choices[0].message.content.strip()
+        code_text = strip_markdown_fences(content)
+        if not code_text:
+            return {"code": "", "output": "The coder produced no code."}
+        code_text = make_headless(code_text)
 
-        # Save the generated code
-        output_directory = "./output"
-        os.makedirs(output_directory, exist_ok=True)
-        script_path = os.path.join(output_directory, "solution.py")
-        with open(script_path, "w", encoding="utf-8") as f:
-            f.write(code_text)
+        # Optionally save the generated code for inspection
+        script_path = "<solution>"
+        if CONFIG["save_solution"]:
+            output_directory = "./output"
+            os.makedirs(output_directory, exist_ok=True)
+            script_path = os.path.join(output_directory, "solution.py")
+            await write_text_file(script_path, code_text)
 
-        # Automatic Syntax Check
-        syntax_error = ""
+        # Automatic Syntax Check: parse in memory, then compile the parsed tree for execution. Some errors
+        # ('return' outside a function, 'break' outside a loop, top-level 'await') are only raised by compile()
         try:
-            py_compile.compile(script_path, doraise=True)
-        except py_compile.PyCompileError as e:
-            syntax_error = f"Syntax error detected: {e}"
+            tree = ast.parse(code_text, filename=script_path)
+            code_obj = compile(tree, script_path, "exec")
+        except SyntaxError as e:
+            return {"code": code_text, "output": f"Syntax error detected: {e}"}
 
-        # Execute the script
+        # Execute the script (in-process by default)
         try:
-            result = subprocess.run(
-                ["python", script_path],
-                capture_output=True,
-                text=True,
-                timeout=CONFIG["api_timeout"]
-            )
-            execution_output = result.stdout + "\n" + result.stderr
+            if CONFIG["execution_mode"] == "subprocess" or needs_subprocess(tree):
+                execution_output = await run_script_in_subprocess(code_text, script_path)
+            else:
+                execution_output = run_script_in_process(code_obj, script_path)
         except Exception as e:
             execution_output = f"Error running code: {e}"
 
-        # If a syntax error was detected, prepend it to the execution output
-        if syntax_error:
-            execution_output = syntax_error + "\n" + execution_output
-
         return {"code": code_text, "output": execution_output}
     except Exception as e:
         return {"code": "", "output": f"An error occurred in coder_function: {e}"}
 
 
-def bojack_horseman_function(data):
+def parse_critiques(content):
     """
-    Calls bojack_horseman to provide purely critical feedback on functional aspects of the code and its output.
-    Emphasize syntax errors if present.
+    Parses the dual-critic JSON response into {"negative": ..., "positive": ...}, or returns None if the
+    response is not a JSON object carrying both critiques (e.g. it was cut off by max_tokens).
     """
-    code_text = data["code"]
-    execution_output = data["output"]
     try:
-        response = client.chat.completions.create(
-            model=CONFIG["model"],
-            messages=[
-                {"role": "system",
-                 "content": (
-                     "You are bojack_horseman. Your job is to evaluate the provided Python code and its execution output, "
-                     "focusing solely on the functional implementation and output quality. "
-                     "If there is a syntax or compilation error, highlight it as the most critical issue. "
-                     "Point out design flaws, logical errors, inefficiencies, and any other critical issues. "
-                     "Do not mention any positive aspects. If no significant issues are found, state that succinctly."
-                 )},
-                {"role": "user",
-                 "content": (
-                     f"Please critique the following Python script and its execution output:\n\n"
-                     f"--- CODE ---\n{code_text}\n\n"
-                     f"--- EXECUTION OUTPUT ---\n{execution_output}\n\n"
-                     "Provide a detailed, purely critical evaluation, prioritizing any syntax or compilation errors."
-                 )}
-            ],
-            temperature=CONFIG["temperature"]
-        )
-        return response.choices[0].message.content.strip()
-    except Exception as e:
-        return f"An error occurred in bojack_horseman_function: {e}"
+        critiques = json.loads(content)
+    except ValueError:
+        return None
+    if not isinstance(critiques, dict) or not critiques.get("negative") or not critiques.get("positive"):
+        return None
+    return {"negative": str(critiques["negative"]).strip(), "positive": str(critiques["positive"]).strip()}
 
 
-def mr_peanut_butter_function(data):
+def salvage_critiques(content):
     """
-    Calls mr_peanut_butter to provide purely positive feedback on functional aspects of the code and its output.
+    Recovers whatever critique text is present in an invalid or truncated dual-critic response,
+    so the Judge still gets usable feedback instead of an error message.
+    """
+    salvaged = {}
+    for key in ("negative", "positive"):
+        match = re.search(r'"%s"\s*:\s*"((?:[^"\\]|\\.)*)' % key, content, flags=re.DOTALL)
+        if match:
+            text = match.group(1).rstrip("\\")
+            try:
+                text = json.loads(f'"{text}"')
+            except ValueError:
+                pass
+            salvaged[key] = text.strip()
+    return salvaged
+
+
+async def dual_critic_function(data):
+    """
+    Calls bojack_horseman and mr_peanut_butter in a single LLM call, so the code and execution output are sent once.
+    bojack_horseman provides purely critical feedback on functional aspects of the code and its output,
+    emphasizing syntax errors if present; mr_peanut_butter provides purely positive feedback.
+    Returns a dictionary with both critical and positive feedback.
     """
     code_text = data["code"]
     execution_output = data["output"]
     try:
-        response = client.chat.completions.create(
-            model=CONFIG["model"],
+        content = await cached_chat_completion(
             messages=[
                 {"role": "system",
                  "content": (
-                     "You are mr_peanut_butter. Your job is to evaluate the provided Python code and its execution output, "
-                     "focusing solely on the functional implementation and output quality. "
-                     "Highlight effective design choices, robust implementation, and well-executed output that demonstrate the code’s ability to fulfill its intended purpose. "
-                     "Do not mention any negative aspects. If no significant positive features are found, state that succinctly."
+                     "You play two reviewers who each evaluate the provided Python code and its execution output, "
+                     "focusing solely on the functional implementation and output quality.\n\n"
+                     "bojack_horseman is purely critical. If there is a syntax or compilation error, he highlights it as the most critical issue. "
+                     "He points out design flaws, logical errors, inefficiencies, and any other critical issues. "
+                     "He does not mention any positive aspects. If no significant issues are found, he states that succinctly.\n\n"
+                     "mr_peanut_butter is purely positive. He highlights effective design choices, robust implementation, and well-executed output "
+                     "that demonstrate the code’s ability to fulfill its intended purpose. "
+                     "He does not mention any negative aspects. If no significant positive features are found, he states that succinctly.\n\n"
+                     'Respond with a JSON object of the form {"negative": "<bojack_horseman\'s evaluation>", '
+                     '"positive": "<mr_peanut_butter\'s evaluation>"}. Keep each evaluation under 250 words.'
                  )},
                 {"role": "user",
                  "content": (
-                     f"Please praise the following Python script and its execution output:\n\n"
+                     f"Please evaluate the following Python script and its execution output:\n\n"
                      f"--- CODE ---\n{code_text}\n\n"
                      f"--- EXECUTION OUTPUT ---\n{execution_output}\n\n"
-                     "Provide a detailed, purely positive evaluation."
+                     "Provide a detailed, purely critical evaluation from bojack_horseman, prioritizing any syntax or compilation errors, "
+                     "and a detailed, purely positive evaluation from mr_peanut_butter."
                  )}
             ],
-            temperature=CONFIG["temperature"]
+            model=CONFIG["feedback_model"],
+            temperature=CONFIG["temperature"],
+            max_tokens=CONFIG["max_tokens"]["critic"],
+            response_format={"type": "json_object"},
+            validate=lambda text: parse_critiques(text) is not None
         )
-        return response.choices[0].message.content.strip()
+        critiques = parse_critiques(content) or salvage_critiques(content)
     except Exception as e:
-        return f"An error occurred in mr_peanut_butter_function: {e}"
+        print(f"An error occurred in dual_critic_function: {e}")
+        critiques = {}
+    # Missing critiques are flagged plainly so the Judge evaluates the code and output directly
+    unavailable = "(No {} feedback is available for this iteration; evaluate the code and execution output directly.)"
+    return {
+        "negative_feedback": critiques.get("negative") or unavailable.format("critical"),
+        "positive_feedback": critiques.get("positive") or unavailable.format("positive")
+    }
 
 
-async def async_feedback_branch(data):
-    """
-    Asynchronously calls both bojack_horseman_function and mr_peanut_butter_function concurrently.
-    Returns a dictionary with both critical and positive feedback.
-    """
-    loop = asyncio.get_event_loop()
-    bojack_future = loop.run_in_executor(None, bojack_horseman_function, data)
-    mr_peanut_future = loop.run_in_executor(None, mr_peanut_butter_function, data)
-    negative_feedback, positive_feedback = await asyncio.gather(bojack_future, mr_peanut_future)
-    return {"negative_feedback": negative_feedback, "positive_feedback": positive_feedback}
+async def write_text_file(path, text):
+    """Writes text to a file without blocking the event loop."""
+    async with aiofiles.open(path, "w", encoding="utf-8") as f:
+        await f.write(text)
 
 
-def save_feedback_function(feedback):
+async def save_feedback_function(feedback):
     """
-    Saves the feedback from bojack_horseman and mr_peanut_butter into separate files.
+    Saves the feedback from bojack_horseman and mr_peanut_butter into separate files concurrently.
     """
     output_directory = "./output"
     os.makedirs(output_directory, exist_ok=True)
     bojack_file = os.path.join(output_directory, "bojack_horseman.txt")
     mr_peanut_file = os.path.join(output_directory, "mr_peanut_butter.txt")
     try:
-        with open(bojack_file, "w", encoding="utf-8") as f:
-            f.write(feedback.get("negative_feedback", ""))
-        with open(mr_peanut_file, "w", encoding="utf-8") as f:
-            f.write(feedback.get("positive_feedback", ""))
+        await asyncio.gather(
+            write_text_file(bojack_file, feedback.get("negative_feedback", "")),
+            write_text_file(mr_peanut_file, feedback.get("positive_feedback", ""))
+        )
         return f"Feedback saved successfully: {bojack_file}, {mr_peanut_file}"
     except Exception as e:
         return f"An error occurred while saving feedback: {e}"
 
 
-def judge_function(manager_outline, coder_result, feedback, review_count, conversation_history):
+def code_diff(previous_code, new_code):
+    """
+    Returns a unified diff between the previous and the new version of the generated script.
+    """
+    diff = difflib.unified_diff(
+        previous_code.splitlines(keepends=True),
+        new_code.splitlines(keepends=True),
+        fromfile="previous/solution.py",
+        tofile="solution.py"
+    )
+    return "".join(diff) or "(no changes)"
+
+
+async def summarizer_function(running_summary, iteration_record):
+    """
+    Calls a cheap LLM to fold the latest iteration into the rolling summary passed to the Judge.
+    Keeps the Judge's input bounded instead of growing with the full conversation history.
+    Falls back to the previous summary if the call fails.
+    """
+    try:
+        content = await cached_chat_completion(
+            messages=[
+                {"role": "system",
+                 "content": (
+                     "You maintain a running summary of a code review loop between a Coder, two critics and a Judge. "
+                     "Update the summary with the latest iteration. Keep only what matters for the next review: "
+                     "issues raised, fixes requested, and which of them have been resolved. Be concise."
+                 )},
+                {"role": "user",
+                 "content": (
+                     f"--- CURRENT SUMMARY ---\n{running_summary or '(empty)'}\n\n"
+                     f"--- LATEST ITERATION ---\n{iteration_record}"
+                 )}
+            ],
+            model=CONFIG["summary_model"],
+            temperature=CONFIG["deterministic_temperature"],
+            max_tokens=CONFIG["max_tokens"]["summary"]
+        )
+        return content.strip()
+    except Exception as e:
+        print(f"An error occurred in summarizer_function: {e}")
+        return running_summary
+
+
+async def judge_function(manager_outline, coder_result, feedback, review_count, running_summary="",
+                         previous_code="", on_token=None):
     """
     Calls the Judge LLM to evaluate whether the script meets the Manager's outline.
-    Incorporates conversation history for stateful context.
+    Incorporates a rolling summary of previous iterations for stateful context, and only the diff
+    of the code when a previous version exists.
     Prioritize syntax errors if detected.
     """
     try:
-        judge_prompt = (
+        # Static scaffold: identical across iterations, so it forms a cacheable prompt prefix.
+        judge_scaffold = (
             f"Manager's Outline:\n{manager_outline}\n\n"
-            f"Python Code:\n{coder_result['code']}\n\n"
-            f"Execution Output:\n{coder_result['output']}\n\n"
-            f"Feedback from bojack_horseman (critical):\n{feedback['negative_feedback']}\n\n"
-            f"Feedback from mr_peanut_butter (positive):\n{feedback['positive_feedback']}\n\n"
-            "Based on the above, determine whether the script achieves the Manager's outline. "
+            "The next message contains the current iteration: the Python code (or its diff against the previous "
+            "iteration), its execution output, and the feedback from bojack_horseman and mr_peanut_butter. "
+            "Based on it, determine whether the script achieves the Manager's outline. "
             "If a syntax or compilation error is present, prioritize this as the main issue that must be fixed immediately. "
             "If the script meets the outline, provide a brief summary and state that the goal has been achieved. "
             "If not, provide clear instructions for the coder to modify the code. "
             "Do not invent issues or strengths beyond what is provided."
         )
-        if conversation_history:
-            judge_prompt += "\n\nConversation History:\n" + "\n".join(conversation_history)
+
+        # Per-iteration delta
+        judge_prompt = ""
+        if running_summary:
+            judge_prompt += f"Summary of Previous Iterations:\n{running_summary}\n\n"
+        if previous_code:
+            judge_prompt += (
+                "Changes to the Python Code since the previous iteration (unified diff):\n"
+                f"{code_diff(previous_code, coder_result['code'])}\n\n"
+            )
+        else:
+            judge_prompt += f"Python Code:\n{coder_result['code']}\n\n"
+        judge_prompt += (
+            f"Execution Output:\n{coder_result['output']}\n\n"
+            f"Feedback from bojack_horseman (critical):\n{feedback['negative_feedback']}\n\n"
+            f"Feedback from mr_peanut_butter (positive):\n{feedback['positive_feedback']}"
+        )
         if review_count >= CONFIG["max_review_iterations"]:
             judge_prompt += (
-                "\nThis is your final review. End the process by providing a final summary, "
+                "\n\nThis is your final review. End the process by providing a final summary, "
                 "regardless of whether the script fully meets the outline or not."
             )
-        response = client.chat.completions.create(
-            model=CONFIG["model"],
+
+        content = await cached_chat_completion(
             messages=[
                 {"role": "system",
                  "content": (
@@ -283,18 +831,43 @@ def judge_function(manager_outline, coder_result, feedback, review_count, conver
                      "If it does not, provide clear instructions for the coder to modify the code, prioritizing any syntax errors. "
                      "Focus strictly on whether the functional goals have been met."
                  )},
+                {"role": "user", "content": judge_scaffold},
                 {"role": "user", "content": judge_prompt}
             ],
-            temperature=CONFIG["temperature"]
+            temperature=CONFIG["deterministic_temperature"],
+            max_tokens=CONFIG["max_tokens"]["judge"],
+            on_token=on_token
         )
-        judge_response = response.choices[0].message.content.strip()
+        judge_response = content.strip()
         achieved = "achieved" in judge_response.lower() or "final summary" in judge_response.lower()
         return {"achieved": achieved, "instruction": judge_response}
     except Exception as e:
         return {"achieved": False, "instruction": f"An error occurred in judge_function: {e}"}
 
 
-def reporter_function(conversation_log):
+async def summarize_log_chunk(entries):
+    """
+    Map step of the Reporter: condenses a chunk of conversation log entries with the cheap summary model,
+    keeping one line per exchange in the same "**Speaker to Listener (Iteration N)**: ..." form.
+    """
+    content = await cached_chat_completion(
+        messages=[
+            {"role": "system",
+             "content": (
+                 "You condense conversation log entries between LLMs in a code review pipeline. "
+                 "Keep one line per exchange, preserving the bold speaker prefix (who spoke to whom and the iteration) "
+                 "and shortening the message to what was communicated and why."
+             )},
+            {"role": "user", "content": "\n".join(entries)}
+        ],
+        model=CONFIG["summary_model"],
+        temperature=CONFIG["deterministic_temperature"],
+        max_tokens=CONFIG["max_tokens"]["summary"]
+    )
+    return content.strip()
+
+
+async def reporter_function(run=None):
     """
     Calls the Reporter LLM to produce a detailed and illustrated report of the conversation between all LLMs.
     The report should include bullet points summarizing each exchange, similar to:
@@ -308,9 +881,17 @@ def reporter_function(conversation_log):
     - **Judge to Coder (Iteration 2)**: Judge confirmed the script now meets the outline, and the task is complete.
     - **Judge**: Declared the task completed successfully, ending the pipeline.
 
+    The conversation log of the run is read from disk. Long logs are first summarized in chunks by the
+    cheap summary model (map), and only those summaries are passed to the Reporter (reduce).
     The report is saved to 'report.txt'.
     """
     try:
+        entries = [record["content"] for record in read_conversation_log(run)]
+        if len(entries) > CONFIG["reporter_chunk_size"]:
+            chunks = [entries[i:i + CONFIG["reporter_chunk_size"]]
+                      for i in range(0, len(entries), CONFIG["reporter_chunk_size"])]
+            entries = await asyncio.gather(*(summarize_log_chunk(chunk) for chunk in chunks))
+
         # Instruct Reporter with a detailed sample format
         report_instructions = (
             "Please produce a detailed report summarizing the conversation between all LLMs in the following format:\n\n"
@@ -324,89 +905,262 @@ def reporter_function(conversation_log):
             "- **Judge**: Declared the task completed successfully, achieving the goal set out by the Manager, and ended the pipeline.\n\n"
             "Now, using the following conversation log, produce a bullet-point summary of the conversation:"
         )
-        report_prompt = report_instructions + "\n\n" + "\n".join(conversation_log)
-        response = client.chat.completions.create(
-            model=CONFIG["model"],
-            messages=[
-                {"role": "system",
-                 "content": (
-                     "You are Reporter. Your task is to produce a detailed and illustrated report summarizing the conversation between all LLMs. "
-                     "Follow the sample format provided exactly, including bullet points that describe who spoke to whom, why, and what was communicated."
-                 )},
-                {"role": "user", "content": report_prompt}
-            ],
-            temperature=CONFIG["temperature"]
+        report_prompt = report_instructions + "\n\n" + "\n".join(entries)
+        messages = [
+            {"role": "system",
+             "content": (
+                 "You are Reporter. Your task is to produce a detailed and illustrated report summarizing the conversation between all LLMs. "
+                 "Follow the sample format provided exactly, including bullet points that describe who spoke to whom, why, and what was communicated."
+             )},
+            {"role": "user", "content": report_prompt}
+        ]
+
+        # The report is terminal and not latency-critical, so it can be deferred to a batch job
+        if CONFIG["reporter_batch"]:
+            return queue_reporter_request(messages)
+
+        content = await cached_chat_completion(
+            messages=messages,
+            temperature=CONFIG["temperature"],
+            max_tokens=CONFIG["max_tokens"]["reporter"]
         )
-        report_text = response.choices[0].message.content.strip()
+        report_text = content.strip()
 
         # Save the report to a .txt file
         report_path = os.path.join("./output", "report.txt")
-        with open(report_path, "w", encoding="utf-8") as f:
-            f.write(report_text)
+        await write_text_file(report_path, report_text)
         return f"Report saved successfully to {report_path}\n\nReport:\n{report_text}"
     except Exception as e:
         return f"An error occurred in reporter_function: {e}"
 
 
+# ---------------------------
+# Batch API Support for Deferred Reports
+# ---------------------------
+def queue_reporter_request(messages):
+    """
+    Appends a reporter request to the pending batch file instead of calling the API.
+    The queued requests are submitted together with submit_reporter_batch().
+    """
+    os.makedirs(CONFIG["batch_dir"], exist_ok=True)
+    queue_path = os.path.join(CONFIG["batch_dir"], "reporter_requests.jsonl")
+    custom_id = f"report-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    request = {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": {
+            "model": CONFIG["model"],
+            "temperature": CONFIG["temperature"],
+            "max_tokens": CONFIG["max_tokens"]["reporter"],
+            "messages": messages
+        }
+    }
+    with open(queue_path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(request) + "\n")
+    return f"Report queued for batch submission as {custom_id} in {queue_path}"
+
+
+async def submit_reporter_batch():
+    """
+    Uploads all queued reporter requests and creates a single Batch API job for them.
+    Returns the batch id, which is later passed to collect_reporter_batch().
+    """
+    queue_path = os.path.join(CONFIG["batch_dir"], "reporter_requests.jsonl")
+    if not os.path.exists(queue_path) or os.path.getsize(queue_path) == 0:
+        return "No queued reporter requests to submit."
+    try:
+        with open(queue_path, "rb") as f:
+            input_file = await client.files.create(file=f, purpose="batch")
+        batch = await client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h"
+        )
+        # Keep the submitted requests for reference and start a fresh queue
+        os.replace(queue_path, os.path.join(CONFIG["batch_dir"], f"submitted_{batch.id}.jsonl"))
+        return f"Submitted reporter batch {batch.id} (status: {batch.status})"
+    except Exception as e:
+        return f"An error occurred while submitting the reporter batch: {e}"
+
+
+async def collect_reporter_batch(batch_id):
+    """
+    Retrieves a completed reporter batch and saves each report to './output/report_<custom_id>.txt'.
+    If the batch is still running, its current status is returned instead.
+    """
+    try:
+        batch = await client.batches.retrieve(batch_id)
+        if batch.status != "completed":
+            return f"Reporter batch {batch_id} is not complete yet (status: {batch.status})"
+
+        output = await client.files.content(batch.output_file_id)
+        saved_paths = []
+        for line in output.text.splitlines():
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            if result.get("error") or result["response"]["status_code"] != 200:
+                print(f"Batch request {result['custom_id']} failed: {result.get('error') or result['response']}")
+                continue
+            report_text = result["response"]["body"]["choices"][0]["message"]["content"].strip()
+            report_path = os.path.join("./output", f"report_{result['custom_id']}.txt")
+            await write_text_file(report_path, report_text)
+            saved_paths.append(report_path)
+        return f"Saved {len(saved_paths)} report(s) from batch {batch_id}: {', '.join(saved_paths)}"
+    except Exception as e:
+        return f"An error occurred while collecting reporter batch {batch_id}: {e}"
+
+
 # ---------------------------
 # Main Pipeline Execution with Judge Loop (Asynchronous Main)
 # ---------------------------
-async def main():
-    user_request = input("Enter your request: ")
+async def main(resume=False):
+    global run_id, logged_records, records_to_skip
+    checkpoint = load_checkpoint() if resume else None
+    if resume and checkpoint is None:
+        print("No checkpoint found; starting a new run.")
 
-    # Manager LLM produces the outline
-    manager_outline = manager_function(user_request)
-    print("\nManager's Outline:\n", manager_outline)
-    conversation_log.append("**Manager to Coder**: Manager provided the detailed outline for the task.")
+    def save_state():
+        save_checkpoint({
+            "run_id": run_id,
+            "user_request": user_request,
+            "manager_outline": manager_outline,
+            "review_count": review_count,
+            "achieved": achieved,
+            "extra_instruction": extra_instruction,
+            "running_summary": running_summary,
+            "previous_code": previous_code,
+            "log_records": logged_records
+        })
 
     review_count = 1
     achieved = False
     extra_instruction = ""
+    running_summary = ""
+    previous_code = ""
+
+    if checkpoint:
+        # Resume an interrupted run from its last completed stage
+        run_id = checkpoint["run_id"]
+        user_request = checkpoint["user_request"]
+        manager_outline = checkpoint["manager_outline"]
+        review_count = checkpoint["review_count"]
+        achieved = checkpoint["achieved"]
+        extra_instruction = checkpoint["extra_instruction"]
+        running_summary = checkpoint["running_summary"]
+        previous_code = checkpoint["previous_code"]
+        # Records written after the checkpoint by the interrupted iteration are replayed, not duplicated
+        logged_records = checkpoint["log_records"]
+        records_to_skip = max(0, sum(1 for _ in read_conversation_log(run_id)) - logged_records)
+        print(f"Resuming run {run_id} for request: {user_request}")
+        print("\nManager's Outline:\n", manager_outline)
+    else:
+        user_request = input("Enter your request: ")
+
+        # Manager LLM produces the outline, unless one is already cached for this exact request
+        manager_stream = ConsoleStream("Manager's Outline")
+        manager_outline = load_cached_outline(user_request)
+        if manager_outline is None:
+            manager_outline = await manager_function(user_request, on_token=manager_stream)
+            if not manager_outline.startswith("An error occurred"):
+                save_cached_outline(user_request, manager_outline)
+        manager_stream.finish(manager_outline)
+        log_event("manager", "**Manager to Coder**: Manager provided the detailed outline for the task.")
+        save_state()
 
     while review_count <= CONFIG["max_review_iterations"] and not achieved:
         print(f"\n=== Judge Review Iteration {review_count} ===")
-        # Coder LLM generates or updates the code using the plan and any extra instruction from the Judge
-        coder_result = coder_function(manager_outline, extra_instruction)
-        print("\nCoder's Code:\n", coder_result["code"])
-        print("\nCoder's Execution Output:\n", coder_result["output"])
-        conversation_log.append(
-            f"**Coder to Bojack/Mr_Peanut (Iteration {review_count})**: Coder generated the code and execution output.")
-
-        # Generate feedback asynchronously from bojack_horseman and mr_peanut_butter concurrently
-        feedback = await async_feedback_branch(coder_result)
-        print("\nFeedback from bojack_horseman:\n", feedback["negative_feedback"])
-        print("\nFeedback from mr_peanut_butter:\n", feedback["positive_feedback"])
-        conversation_log.append(
-            f"**Bojack_Horseman/Mr_Peanut (Iteration {review_count})**: Provided critical and positive feedback on the coder's output.")
-
-        # Save the feedback to files
-        save_feedback_function(feedback)
-
-        # Judge reviews everything including conversation history
-        judge_decision = judge_function(manager_outline, coder_result, feedback, review_count, conversation_log)
-        print("\nJudge's Decision:\n", judge_decision["instruction"])
-        conversation_log.append(f"**Judge to Coder (Iteration {review_count})**: {judge_decision['instruction']}")
+        coder_stream = ConsoleStream("Coder's Code")
+        judge_stream = ConsoleStream("Judge's Decision")
+
+        async def coder_node():
+            # Coder LLM generates or updates the code using the plan and any extra instruction from the Judge
+            result = await coder_function(manager_outline, extra_instruction, on_token=coder_stream)
+            coder_stream.finish(result["code"] or result["output"])
+            print("\nCoder's Execution Output:\n", result["output"])
+            log_event(
+                "coder", f"**Coder to Bojack/Mr_Peanut (Iteration {review_count})**: Coder generated the code and execution output.")
+            return result
+
+        async def critics_node(coder):
+            # Generate feedback from bojack_horseman and mr_peanut_butter in a single call
+            result = await dual_critic_function(coder)
+            print("\nFeedback from bojack_horseman:\n", result["negative_feedback"])
+            print("\nFeedback from mr_peanut_butter:\n", result["positive_feedback"])
+            log_event(
+                "critics", f"**Bojack_Horseman/Mr_Peanut (Iteration {review_count})**: Provided critical and positive feedback on the coder's output.")
+            return result
+
+        async def judge_node(coder, critics):
+            # Judge reviews everything including the rolling summary
+            result = await judge_function(manager_outline, coder, critics, review_count, running_summary,
+                                          previous_code, on_token=judge_stream)
+            judge_stream.finish(result["instruction"])
+            log_event("judge", f"**Judge to Coder (Iteration {review_count})**: {result['instruction']}")
+            return result
+
+        # The feedback files are saved while the Judge runs, since neither depends on the other
+        results = await run_dag([
+            Node("coder", coder_node),
+            Node("critics", critics_node, depends_on=["coder"]),
+            Node("save_feedback", lambda critics: save_feedback_function(critics), depends_on=["critics"]),
+            Node("judge", judge_node, depends_on=["coder", "critics"])
+        ])
+        coder_result, feedback, judge_decision = results["coder"], results["critics"], results["judge"]
 
         if judge_decision["achieved"]:
             achieved = True
             final_summary = judge_decision["instruction"]
             print("\nFinal Summary and Decision by Judge:\n", final_summary)
-            conversation_log.append(
-                "**Judge**: Declared the task completed successfully, achieving the goal set out by the Manager, and ended the pipeline.")
-            break
+            log_event(
+                "judge", "**Judge**: Declared the task completed successfully, achieving the goal set out by the Manager, and ended the pipeline.")
         else:
             extra_instruction = judge_decision["instruction"]
+            previous_code = coder_result["code"]
+            if review_count < CONFIG["max_review_iterations"]:
+                running_summary = await summarizer_function(running_summary, (
+                    f"Iteration {review_count}\n"
+                    f"Execution Output:\n{coder_result['output']}\n\n"
+                    f"Critical feedback:\n{feedback['negative_feedback']}\n\n"
+                    f"Judge's instruction:\n{judge_decision['instruction']}"
+                ))
             review_count += 1
 
+        save_state()
+
     if not achieved:
         print("\nJudge's final review completed. The pipeline is terminating with the current version of the script.")
-        conversation_log.append(
-            "**Judge**: Final review completed. Pipeline terminates without fully meeting the goal.")
+        log_event(
+            "judge", "**Judge**: Final review completed. Pipeline terminates without fully meeting the goal.")
 
     # Reporter LLM produces a summary report of the conversation
-    report_result = reporter_function(conversation_log)
+    report_result = await reporter_function(run_id)
     print("\nReporter Output:\n", report_result)
+    clear_checkpoint()
+
+
+async def run_with_client(coroutine):
+    """Runs a coroutine and then closes the shared HTTP connection pool on the same event loop."""
+    try:
+        return await coroutine
+    finally:
+        await client.close()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="LLM-powered code review pipeline.")
+    parser.add_argument("--submit-reporter-batch", action="store_true",
+                        help="Submit all queued reporter requests as one Batch API job and exit.")
+    parser.add_argument("--collect-reporter-batch", metavar="BATCH_ID",
+                        help="Save the reports from a completed reporter batch and exit.")
+    parser.add_argument("--resume", action="store_true",
+                        help="Resume an interrupted run from its last checkpoint instead of starting a new one.")
+    args = parser.parse_args()
+
+    if args.submit_reporter_batch:
+        print(asyncio.run(run_with_client(submit_reporter_batch())))
+    elif args.collect_reporter_batch:
+        print(asyncio.run(run_with_client(collect_reporter_batch(args.collect_reporter_batch))))
+    else:
+        asyncio.run(run_with_client(main(resume=args.resume)))
@@ -0,0 +1,128 @@
+import os
+import json
+import tempfile
+import numpy as np
+
+# ---------------------------
+# Semantic Cache for Near-Duplicate Prompts
+# ---------------------------
+# faiss and sentence_transformers (which pulls in torch) are imported on first use, so runs that
+# never consult the cache (e.g. --submit-reporter-batch) do not pay for loading them.
+_encoder = None
+
+
+def _get_encoder(model_name):
+    """Loads the sentence embedding model once and reuses it for every cache."""
+    global _encoder
+    if _encoder is None:
+        from sentence_transformers import SentenceTransformer
+        _encoder = SentenceTransformer(model_name)
+    return _encoder
+
+
+def _atomic_write(path, write):
+    """Calls write(temporary_path) and then moves the file over path, so readers never see a partial file."""
+    directory = os.path.dirname(path) or "."
+    fd, temporary_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    os.close(fd)
+    try:
+        write(temporary_path)
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.remove(temporary_path)
+        raise
+
+
+class SemanticCache:
+    def __init__(self, cache_dir, threshold=0.92, model_name="sentence-transformers/all-MiniLM-L6-v2"):
+        """
+        :param cache_dir: Directory holding the FAISS index and the jsonl sidecar of cached responses.
+        :param threshold: Minimum cosine similarity for a stored prompt to count as a hit.
+        :param model_name: The sentence-transformers model used to embed prompts.
+        """
+        self.cache_dir = cache_dir
+        self.threshold = threshold
+        self.model_name = model_name
+        self.index_path = os.path.join(cache_dir, "index.faiss")
+        self.records_path = os.path.join(cache_dir, "responses.jsonl")
+        self.index = None
+        self.records = []
+
+    def _load(self):
+        """
+        Loads the persisted index and records on first use. The sidecar is the source of truth: if the
+        index is missing, unreadable or out of step with it, the index is rebuilt from the stored prompts.
+        """
+        if self.index is not None:
+            return
+        import faiss
+        self.records = []
+        if os.path.exists(self.records_path):
+            with open(self.records_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                        self.records.append({"prompt": record["prompt"], "response": record["response"]})
+                    except (ValueError, KeyError, TypeError):
+                        continue  # a torn or corrupt line is dropped
+        try:
+            index = faiss.read_index(self.index_path) if os.path.exists(self.index_path) else None
+        except RuntimeError:
+            index = None  # a truncated index file is rebuilt below
+        if index is not None and index.ntotal == len(self.records):
+            self.index = index
+            return
+        dimension = _get_encoder(self.model_name).get_sentence_embedding_dimension()
+        # Inner product over normalised embeddings is cosine similarity.
+        self.index = faiss.IndexFlatIP(dimension)
+        if self.records:
+            self.index.add(self._embed([record["prompt"] for record in self.records]))
+
+    def _fits(self, text):
+        """
+        Returns True if the text fits within the encoder's sequence limit (256 word pieces for MiniLM-L6-v2).
+        Longer inputs are silently truncated by the encoder, so their embeddings only reflect the start of
+        the text and near-identical prefixes would be reported as matches.
+        """
+        encoder = _get_encoder(self.model_name)
+        return len(encoder.tokenizer(text)["input_ids"]) <= encoder.max_seq_length
+
+    def _embed(self, texts):
+        """Returns the normalised embeddings of the texts as a (len(texts), dimension) float32 array."""
+        vectors = _get_encoder(self.model_name).encode(texts, normalize_embeddings=True)
+        return np.asarray(vectors, dtype="float32")
+
+    def lookup(self, text):
+        """
+        Returns the cached response for the most similar stored prompt if its cosine similarity
+        exceeds the threshold, otherwise None. Texts too long to embed in full are always a miss.
+        """
+        self._load()
+        if self.index.ntotal == 0 or not self._fits(text):
+            return None
+        scores, ids = self.index.search(self._embed([text]), 1)
+        if scores[0][0] > self.threshold:
+            return self.records[ids[0][0]]["response"]
+        return None
+
+    def add(self, text, response):
+        """
+        Stores the response for the prompt and persists the sidecar and index to disk. Both files are
+        replaced atomically; a crash between the two writes leaves them out of step, which the next
+        _load detects and repairs. Texts too long to embed in full are not stored.
+        """
+        import faiss
+        self._load()
+        if not self._fits(text):
+            return
+        self.index.add(self._embed([text]))
+        self.records.append({"prompt": text, "response": response})
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        def write_records(path):
+            with open(path, "w", encoding="utf-8") as f:
+                for record in self.records:
+                    f.write(json.dumps(record) + "\n")
+
+        _atomic_write(self.records_path, write_records)
+        _atomic_write(self.index_path, lambda path: faiss.write_index(self.index, path))